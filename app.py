@@ -1,65 +1,238 @@
 import streamlit as st
-import os
+import io
+import re
 import hashlib
 import pickle
+import json
 from pathlib import Path
-from typing import List, Dict, Any
-import tempfile
-import shutil
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import blake3
+import msgpack
+import numpy as np
 
 from document_processor import DocumentProcessor
 from vector_store import VectorStore
 from rag_engine import RAGEngine
 
+LEGACY_HASH_LENGTH = 32  # hex digits in an MD5 digest
+MAX_INGEST_WORKERS = 8
+
+# Pattern to match <think>...</think> content
+THINK_PATTERN = re.compile(r'<think>(.*?)</think>', re.DOTALL)
+
+def _quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize embeddings to int8 with one symmetric scale per vector."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scale = np.max(np.abs(embeddings), axis=1, keepdims=True) / 127
+    scale[scale == 0] = 1  # all-zero vectors quantize to zeros with any scale
+    quantized = np.round(embeddings / scale).astype(np.int8)
+    return quantized, scale
+
+def _dequantize_embeddings(quantized: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """Restore float32 embeddings from their int8 values and per-vector scales."""
+    return quantized.astype(np.float32) * scale
+
+# Heavy components are shared by every session in the Streamlit process, so all
+# users go through one ChromaDB client and one Ollama client
+@st.cache_resource
+def get_document_processor() -> DocumentProcessor:
+    return DocumentProcessor()
+
+@st.cache_resource
+def get_vector_store() -> VectorStore:
+    return VectorStore()
+
+@st.cache_resource
+def get_rag_engine() -> RAGEngine:
+    return RAGEngine()
+
 class RAGApp:
     def __init__(self):
         self.cache_dir = Path("cache")
         self.cache_dir.mkdir(exist_ok=True)
+        self._convert_legacy_cache()
+        
+        # Cache entries written before the switch to BLAKE3 are keyed by MD5
+        self.legacy_hashes = {
+            p.name.split('.', 1)[0] for p in self.cache_dir.glob("*.meta.json")
+            if len(p.name.split('.', 1)[0]) == LEGACY_HASH_LENGTH
+        }
         
-        self.doc_processor = DocumentProcessor()
-        self.vector_store = VectorStore()
-        self.rag_engine = RAGEngine()
+        self.doc_processor = get_document_processor()
+        self.vector_store = get_vector_store()
+        self.rag_engine = get_rag_engine()
         
     def parse_thinking_mode(self, text: str) -> Dict[str, str]:
         """Parse text that may contain <think></think> tags."""
-        import re
-        
-        # Pattern to match <think>...</think> content
-        think_pattern = r'<think>(.*?)</think>'
-        
-        # Find thinking content
-        think_matches = re.findall(think_pattern, text, re.DOTALL)
-        thinking_content = think_matches[0].strip() if think_matches else ""
+        # One pass: even parts are answer text, odd parts are thinking content
+        parts = THINK_PATTERN.split(text)
+        thinking_content = parts[1].strip() if len(parts) > 1 else ""
         
         # Remove thinking tags from the main content
-        clean_text = re.sub(think_pattern, '', text, flags=re.DOTALL).strip()
+        clean_text = "".join(parts[::2]).strip()
         
         return {
             'thinking': thinking_content,
             'answer': clean_text
         }
         
-    def get_file_hash(self, file_path: str) -> str:
-        """Generate hash for file to check if it's been processed before."""
-        with open(file_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+    def get_file_hash(self, data: bytes) -> str:
+        """Generate hash for file contents to check if it's been processed before."""
+        file_hash = blake3.blake3(data, max_threads=blake3.blake3.AUTO).hexdigest()
+        if self.legacy_hashes and not self.is_file_processed(file_hash):
+            self._migrate_legacy_cache(data, file_hash)
+        return file_hash
+    
+    def _migrate_legacy_cache(self, data: bytes, file_hash: str):
+        """Rename an MD5-keyed cache entry for this file to its BLAKE3 key."""
+        legacy_hash = hashlib.md5(data, usedforsecurity=False).hexdigest()
+        
+        if legacy_hash in self.legacy_hashes:
+            for legacy_file in self.cache_dir.glob(f"{legacy_hash}.*"):
+                suffix = legacy_file.name.split('.', 1)[1]
+                legacy_file.rename(self.cache_dir / f"{file_hash}.{suffix}")
+            self.legacy_hashes.discard(legacy_hash)
+    
+    def ingest_file(self, data: bytes, filename: str) -> Tuple[Dict[str, Any], bool]:
+        """
+        Hash an uploaded file and load it from cache, or process it.
+        
+        Args:
+            data: Contents of the uploaded file
+            filename: Original filename
+            
+        Returns:
+            Tuple of (document, loaded_from_cache), where document holds file_hash,
+            chunks, metadata and embeddings (None if they still need computing)
+        """
+        # Check if file has been processed before
+        file_hash = self.get_file_hash(data)
+        if self.is_file_processed(file_hash):
+            # Load from cache
+            document = self.load_processed_file(file_hash)
+            document['file_hash'] = file_hash
+            return document, True
+        
+        # Process the file; it is cached once its embeddings are computed
+        chunks, metadata = self.doc_processor.process_file(io.BytesIO(data), filename)
+        return {'file_hash': file_hash, 'chunks': chunks, 'metadata': metadata, 'embeddings': None}, False
+    
+    def index_documents(self, documents: List[Dict[str, Any]]):
+        """Add ingested documents to the vector store and cache any newly computed embeddings."""
+        # A file uploaded twice in one batch is indexed and cached once
+        unique_documents = {}
+        for doc in documents:
+            unique_documents.setdefault(doc['file_hash'], doc)
+        
+        computed_embeddings = self.vector_store.add_documents_batch(
+            [(doc['file_hash'], doc['chunks'], doc['metadata'], doc['embeddings'])
+             for doc in unique_documents.values()]
+        )
+        for file_hash, doc in unique_documents.items():
+            if doc['embeddings'] is None:
+                # Embeddings are None here if the chunks were already in the vector store
+                self.save_processed_file(file_hash, doc['chunks'], doc['metadata'],
+                                         computed_embeddings.get(file_hash))
+    
+    def _convert_legacy_cache(self):
+        """Split single-file pickle/msgpack cache entries into metadata and chunk files."""
+        for legacy_file in list(self.cache_dir.glob("*.pkl")) + list(self.cache_dir.glob("*.mpk")):
+            if len(legacy_file.suffixes) != 1:
+                continue
+            try:
+                with open(legacy_file, 'rb') as f:
+                    if legacy_file.suffix == '.pkl':
+                        data = pickle.load(f)
+                    else:
+                        data = msgpack.unpackb(f.read(), raw=False)
+                self.save_processed_file(legacy_file.stem, data['chunks'], data['metadata'])
+                legacy_file.unlink()
+            except Exception as e:
+                print(f"Warning: Could not convert cache file {legacy_file.name}: {e}")
     
     def is_file_processed(self, file_hash: str) -> bool:
         """Check if file has been processed before."""
-        cache_file = self.cache_dir / f"{file_hash}.pkl"
-        return cache_file.exists()
+        return (self.cache_dir / f"{file_hash}.meta.json").exists()
     
-    def save_processed_file(self, file_hash: str, chunks: List[str], metadata: Dict[str, Any]):
-        """Save processed file chunks to cache."""
-        cache_file = self.cache_dir / f"{file_hash}.pkl"
-        with open(cache_file, 'wb') as f:
-            pickle.dump({'chunks': chunks, 'metadata': metadata}, f)
+    def save_processed_file(self, file_hash: str, chunks: List[str], metadata: Dict[str, Any],
+                            embeddings: Optional[np.ndarray] = None):
+        """Save processed file chunks, and optionally their embeddings, to cache."""
+        # Chunks are written first so a metadata file always points at complete chunks
+        chunks_file = self.cache_dir / f"{file_hash}.chunks.mpk"
+        chunks_file.write_bytes(msgpack.packb(chunks, use_bin_type=True))
+        
+        embeddings_file = self.cache_dir / f"{file_hash}.embeddings.npz"
+        if embeddings is not None:
+            # Stored as int8 to cut cache size and read time by 4x over float32. Only the
+            # cache is quantized: the vector store keeps float32, and the dequantized copies
+            # are only used to index documents missing from it, never to overwrite them.
+            quantized, scale = _quantize_embeddings(embeddings)
+            with open(embeddings_file, 'wb') as f:
+                np.savez(f, quantized=quantized, scale=scale)
+            # Tag the cache entry so embeddings from another model are never reused
+            metadata = {**metadata, 'embedding_model': self.vector_store.embedding_model}
+        else:
+            embeddings_file.unlink(missing_ok=True)
+        
+        meta_file = self.cache_dir / f"{file_hash}.meta.json"
+        meta_file.write_text(json.dumps(metadata), encoding='utf-8')
+    
+    def load_processed_metadata(self, file_hash: str) -> Dict[str, Any]:
+        """Load only the metadata of a processed file from cache."""
+        meta_file = self.cache_dir / f"{file_hash}.meta.json"
+        return json.loads(meta_file.read_bytes())
     
     def load_processed_file(self, file_hash: str) -> Dict[str, Any]:
-        """Load processed file chunks from cache."""
-        cache_file = self.cache_dir / f"{file_hash}.pkl"
-        with open(cache_file, 'rb') as f:
-            return pickle.load(f)
+        """Load processed file chunks, and embeddings if still valid, from cache."""
+        chunks_file = self.cache_dir / f"{file_hash}.chunks.mpk"
+        metadata = self.load_processed_metadata(file_hash)
+        
+        embeddings = None
+        embeddings_file = self.cache_dir / f"{file_hash}.embeddings.npz"
+        if metadata.pop('embedding_model', None) == self.vector_store.embedding_model and embeddings_file.exists():
+            with np.load(embeddings_file) as stored:
+                embeddings = _dequantize_embeddings(stored['quantized'], stored['scale'])
+        
+        return {
+            'chunks': msgpack.unpackb(chunks_file.read_bytes(), raw=False),
+            'metadata': metadata,
+            'embeddings': embeddings
+        }
+    
+    def remove_processed_file(self, file_hash: str):
+        """Remove processed file chunks from cache."""
+        (self.cache_dir / f"{file_hash}.meta.json").unlink(missing_ok=True)
+        (self.cache_dir / f"{file_hash}.chunks.mpk").unlink(missing_ok=True)
+        (self.cache_dir / f"{file_hash}.embeddings.npz").unlink(missing_ok=True)
+
+@st.cache_data(show_spinner=False)
+def _list_cached_docs(cache_dir: str, mtime_ns: int) -> List[Dict[str, Any]]:
+    """
+    List previously processed documents from their cached metadata.
+    
+    Args:
+        cache_dir: Directory holding the document cache
+        mtime_ns: Modification time of cache_dir, used only as the cache key so
+            the listing is rebuilt whenever a cache entry is added or removed
+        
+    Returns:
+        List of dicts with stem, filename, file_type and note (or error)
+    """
+    docs = []
+    for meta_file in Path(cache_dir).glob("*.meta.json"):
+        stem = meta_file.name.split('.', 1)[0]
+        try:
+            meta = json.loads(meta_file.read_bytes())
+            docs.append({
+                'stem': stem,
+                'filename': meta.get('filename', stem),
+                'file_type': meta.get('file_type', 'unknown'),
+                'note': meta.get('note', '')
+            })
+        except Exception as e:
+            docs.append({'stem': stem, 'error': f"Error loading {meta_file.name}: {e}"})
+    return docs
 
 def main():
     st.set_page_config(
@@ -94,38 +267,36 @@ def main():
                     cached_count = 0
                     progress_bar = st.progress(0)
                     status_text = st.empty()
-                    for i, uploaded_file in enumerate(uploaded_files):
-                        # Save uploaded file temporarily
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                            tmp_file.write(uploaded_file.read())
-                            tmp_path = tmp_file.name
+                    pending_documents = []
+                    status_text.text(f"Processing {len(uploaded_files)} file(s)...")
+                    # Hash and parse files concurrently; Streamlit calls stay on this thread
+                    with ThreadPoolExecutor(max_workers=min(MAX_INGEST_WORKERS, len(uploaded_files))) as executor:
+                        futures = {
+                            executor.submit(rag_app.ingest_file, uploaded_file.getvalue(), uploaded_file.name): uploaded_file.name
+                            for uploaded_file in uploaded_files
+                        }
+                        for i, future in enumerate(as_completed(futures)):
+                            filename = futures[future]
+                            try:
+                                document, from_cache = future.result()
+                                if from_cache:
+                                    cached_count += 1
+                                    st.info(f"✅ {filename} loaded from cache")
+                                else:
+                                    processed_count += 1
+                                    st.success(f"✅ {filename} processed successfully")
+                                # Queue for a single vector store add after the loop
+                                pending_documents.append(document)
+                            except Exception as e:
+                                st.error(f"❌ Error processing {filename}: {str(e)}")
+                            # Update progress
+                            progress_bar.progress((i + 1) / len(uploaded_files))
+                    if pending_documents:
+                        status_text.text("Adding documents to vector store...")
                         try:
-                            # Check if file has been processed before
-                            file_hash = rag_app.get_file_hash(tmp_path)
-                            status_text.text(f"Processing {uploaded_file.name}...")
-                            if rag_app.is_file_processed(file_hash):
-                                # Load from cache
-                                cached_data = rag_app.load_processed_file(file_hash)
-                                chunks = cached_data['chunks']
-                                metadata = cached_data['metadata']
-                                cached_count += 1
-                                st.info(f"✅ {uploaded_file.name} loaded from cache")
-                            else:
-                                # Process the file
-                                chunks, metadata = rag_app.doc_processor.process_file(tmp_path, uploaded_file.name)
-                                # Save to cache
-                                rag_app.save_processed_file(file_hash, chunks, metadata)
-                                processed_count += 1
-                                st.success(f"✅ {uploaded_file.name} processed successfully")
-                            # Add to vector store
-                            rag_app.vector_store.add_documents(chunks, metadata)
+                            rag_app.index_documents(pending_documents)
                         except Exception as e:
-                            st.error(f"❌ Error processing {uploaded_file.name}: {str(e)}")
-                        finally:
-                            # Clean up temp file
-                            os.unlink(tmp_path)
-                        # Update progress
-                        progress_bar.progress((i + 1) / len(uploaded_files))
+                            st.error(f"❌ Error adding documents to vector store: {str(e)}")
                     status_text.text("Processing complete!")
                     if processed_count > 0:
                         st.success(f"Processed {processed_count} new file(s)")
@@ -133,38 +304,34 @@ def main():
                         st.info(f"Loaded {cached_count} file(s) from cache")        # Show previously processed documents
         st.markdown("---")
         st.subheader("📁 Previously Processed Documents")
-        cache_dir = Path("cache")
-        processed_files = list(cache_dir.glob("*.pkl"))
-        if processed_files:
-            for cache_file in processed_files:
-                try:
-                    with open(cache_file, 'rb') as f:
-                        data = pickle.load(f)
-                    meta = data.get('metadata', {})
-                    filename = meta.get('filename', cache_file.stem)
-                    file_type = meta.get('file_type', 'unknown')
-                    note = meta.get('note', '')
-                      # Create columns for filename and remove button
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
-                        st.markdown(f"**{filename}** ({file_type})")
-                        if note:
-                            st.caption(note)
-                    with col2:
-                        if st.button("❌", key=f"remove_{cache_file.stem}", help=f"Remove {filename} from cache"):
-                            try:
-                                # Remove from vector store first
-                                removed_chunks = rag_app.vector_store.remove_documents_by_filename(filename)
-                                
-                                # Remove from cache
-                                cache_file.unlink()
-                                
-                                st.success(f"Removed {filename} from cache and vector store ({removed_chunks} chunks)")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Error removing file: {e}")
-                except Exception as e:
-                    st.caption(f"[Error loading {cache_file.name}: {e}]")
+        cache_dir = rag_app.cache_dir
+        processed_docs = _list_cached_docs(str(cache_dir), cache_dir.stat().st_mtime_ns)
+        if processed_docs:
+            for doc in processed_docs:
+                if 'error' in doc:
+                    st.caption(f"[{doc['error']}]")
+                    continue
+                file_hash = doc['stem']
+                filename = doc['filename']
+                # Create columns for filename and remove button
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.markdown(f"**{filename}** ({doc['file_type']})")
+                    if doc['note']:
+                        st.caption(doc['note'])
+                with col2:
+                    if st.button("❌", key=f"remove_{file_hash}", help=f"Remove {filename} from cache"):
+                        try:
+                            # Remove from vector store first
+                            removed_chunks = rag_app.vector_store.remove_documents_by_filename(filename)
+                            
+                            # Remove from cache
+                            rag_app.remove_processed_file(file_hash)
+                            
+                            st.success(f"Removed {filename} from cache and vector store ({removed_chunks} chunks)")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Error removing file: {e}")
         else:
             st.caption("No previously processed documents found.")
       # Main content area
@@ -185,36 +352,44 @@ def main():
         
         # Generate and display answer immediately
         with st.chat_message("assistant"):
-            with st.spinner("Generating answer..."):
-                try:
+            try:
+                with st.spinner("Searching documents..."):
                     # Get relevant documents
-                    relevant_docs = rag_app.vector_store.similarity_search(question, k=5)                    # Generate answer
-                    answer = rag_app.rag_engine.generate_answer(question, relevant_docs)
-                    
-                    # Parse thinking mode content
-                    parsed_content = rag_app.parse_thinking_mode(answer)
-                    
-                    # 1. Display thinking content in collapsible section if present
-                    if parsed_content['thinking']:
+                    relevant_docs = rag_app.vector_store.similarity_search(question, k=5)
+                
+                # 1. Reserve space for the thinking process, known only once the answer is complete
+                thinking_placeholder = st.empty()
+                
+                # 2. Display sources
+                with st.expander("📚 Source Documents", expanded=False):
+                    for i, doc in enumerate(relevant_docs, 1):
+                        st.markdown(f"**Source {i}:** {doc['metadata'].get('filename', 'Unknown')}")
+                        st.markdown(f"```\n{doc['content'][:300]}...\n```")
+                
+                # 3. Stream the main answer as it is generated
+                st.markdown("### Answer")
+                answer_placeholder = st.empty()
+                with answer_placeholder.container():
+                    answer = st.write_stream(rag_app.rag_engine.generate_answer(question, relevant_docs))
+                
+                # Parse thinking mode content from the complete answer
+                parsed_content = rag_app.parse_thinking_mode(answer)
+                
+                # Display thinking content in collapsible section if present
+                if parsed_content['thinking']:
+                    with thinking_placeholder.container():
                         with st.expander("🤔 LLM Thinking Process", expanded=False):
                             st.markdown(parsed_content['thinking'])
-                    
-                    # 2. Display sources
-                    with st.expander("📚 Source Documents", expanded=False):
-                        for i, doc in enumerate(relevant_docs, 1):
-                            st.markdown(f"**Source {i}:** {doc['metadata'].get('filename', 'Unknown')}")
-                            st.markdown(f"```\n{doc['content'][:300]}...\n```")
-                    
-                    # 3. Display the main answer
-                    st.markdown("### Answer")
-                    if parsed_content['answer']:
-                        st.markdown(parsed_content['answer'])
-                    else:
-                        # Fallback if no thinking tags found
-                        st.markdown(answer)
                 
-                except Exception as e:
-                    st.error(f"Error generating answer: {str(e)}")
+                # Replace the raw stream with the answer minus its thinking tags
+                if parsed_content['answer']:
+                    answer_placeholder.markdown(parsed_content['answer'])
+                else:
+                    # Fallback if no thinking tags found
+                    answer_placeholder.markdown(answer)
+            
+            except Exception as e:
+                st.error(f"Error generating answer: {str(e)}")
     
     # Display current documents in vector store
     with st.expander("📊 Document Statistics"):
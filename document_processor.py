@@ -1,39 +1,111 @@
 import os
+import io
+import sys
+import types
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, BinaryIO, Optional, Union
 import docx
 from docx import Document
 from pypdf import PdfReader
 
+SENTENCE_ENDINGS = ('.', '!', '?', '\n\n')
+
+# PDFs with fewer pages are extracted in-process; below this the cost of
+# shipping the file to worker processes outweighs the parallel speedup
+PARALLEL_PDF_MIN_PAGES = 16
+# CPUs this process may run on, which respects container and affinity limits
+PDF_WORKERS = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    """Return the process pool shared by all PDF extractions, creating it on first use."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            # Spawn rather than fork: the pool is created from a worker thread of the
+            # multithreaded Streamlit server, and forking such a process can deadlock
+            _page_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _page_pool
+
+@contextmanager
+def _spawn_without_main():
+    """Hide the running script from workers spawned inside this block.
+
+    Spawned children re-run ``__main__`` from its file, which under Streamlit is
+    app.py and would load the whole app into every worker. With a stand-in that
+    has no file they import only this module. Callers hold ``_page_pool_lock``.
+    """
+    main_module = sys.modules.get('__main__')
+    stand_in = types.ModuleType('__mp_main__')
+    sys.modules['__main__'] = stand_in
+    try:
+        yield
+    finally:
+        if sys.modules.get('__main__') is stand_in:
+            sys.modules['__main__'] = main_module
+
+def _reset_page_pool(pool: ProcessPoolExecutor):
+    """Drop a broken process pool so the next PDF extraction starts a new one."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_pages(reader: PdfReader, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Extract text from pages [start, stop) of a PDF, skipping pages that fail."""
+    page_texts = []
+    for page_num in range(start, stop):
+        try:
+            page_texts.append((page_num, reader.pages[page_num].extract_text()))
+        except Exception as e:
+            # Skip problematic pages but continue processing
+            print(f"Warning: Could not extract text from page {page_num + 1}: {e}")
+    return page_texts
+
+def _extract_page_range(data: bytes, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Worker process entry point: parse the PDF bytes and extract a range of pages."""
+    return _extract_pages(PdfReader(io.BytesIO(data)), start, stop)
+
 class DocumentProcessor:
     def __init__(self):
         self.supported_extensions = ['.docx', '.one', '.pdf']
     
-    def process_file(self, file_path: str, filename: str) -> Tuple[List[str], Dict[str, Any]]:
+    def process_file(self, source: Union[str, BinaryIO], filename: str) -> Tuple[List[str], Dict[str, Any]]:
         """
         Process a file and return chunks and metadata.
         
         Args:
-            file_path: Path to the file
-            filename: Original filename
+            source: Path to the file, or a binary file-like object with its contents
+            filename: Original filename, used to determine the file type
             
         Returns:
             Tuple of (chunks, metadata)        """
-        file_ext = Path(file_path).suffix.lower()
+        file_ext = Path(filename).suffix.lower()
         
         if file_ext == '.docx':
-            return self._process_docx(file_path, filename)
+            return self._process_docx(source, filename)
         elif file_ext == '.one':
-            return self._process_onenote(file_path, filename)
+            return self._process_onenote(source, filename)
         elif file_ext == '.pdf':
-            return self._process_pdf(file_path, filename)
+            return self._process_pdf(source, filename)
         else:
             raise ValueError(f"Unsupported file type: {file_ext}")
     
-    def _process_docx(self, file_path: str, filename: str) -> Tuple[List[str], Dict[str, Any]]:
+    def _process_docx(self, source: Union[str, BinaryIO], filename: str) -> Tuple[List[str], Dict[str, Any]]:
         """Process Word document."""
         try:
-            doc = Document(file_path)
+            doc = Document(source)
             
             # Extract text from paragraphs
             text_content = []
@@ -70,7 +142,7 @@ class DocumentProcessor:
         except Exception as e:
             raise Exception(f"Error processing Word document: {str(e)}")
     
-    def _process_onenote(self, file_path: str, filename: str) -> Tuple[List[str], Dict[str, Any]]:
+    def _process_onenote(self, source: Union[str, BinaryIO], filename: str) -> Tuple[List[str], Dict[str, Any]]:
         """
         Attempt to process a OneNote file. Local .one files are not supported for direct parsing.
         Suggest exporting to a supported format.
@@ -88,26 +160,30 @@ class DocumentProcessor:
         }
         return chunks, metadata
     
-    def _process_pdf(self, file_path: str, filename: str) -> Tuple[List[str], Dict[str, Any]]:
+    def _process_pdf(self, source: Union[str, BinaryIO], filename: str) -> Tuple[List[str], Dict[str, Any]]:
         """Process PDF document."""
         try:
-            reader = PdfReader(file_path)
+            reader = PdfReader(source)
             
             # Extract text from all pages
             text_content = []
             total_pages = len(reader.pages)
             
-            for page_num, page in enumerate(reader.pages):
+            if PDF_WORKERS > 1 and total_pages >= PARALLEL_PDF_MIN_PAGES:
                 try:
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        # Add page number for reference
-                        page_content = f"[Page {page_num + 1}]\n{page_text.strip()}"
-                        text_content.append(page_content)
-                except Exception as e:
-                    # Skip problematic pages but continue processing
-                    print(f"Warning: Could not extract text from page {page_num + 1}: {e}")
-                    continue
+                    page_texts = self._extract_pages_parallel(source, total_pages)
+                except BrokenProcessPool as e:
+                    # A worker died (e.g. killed for memory); extract this file in-process
+                    print(f"Warning: PDF worker pool failed, extracting pages in-process: {e}")
+                    page_texts = _extract_pages(reader, 0, total_pages)
+            else:
+                page_texts = _extract_pages(reader, 0, total_pages)
+            
+            for page_num, page_text in page_texts:
+                if page_text.strip():
+                    # Add page number for reference
+                    page_content = f"[Page {page_num + 1}]\n{page_text.strip()}"
+                    text_content.append(page_content)
             
             # Combine all text
             full_text = "\n\n".join(text_content)
@@ -128,6 +204,33 @@ class DocumentProcessor:
         except Exception as e:
             raise Exception(f"Error processing PDF document: {str(e)}")
     
+    def _extract_pages_parallel(self, source: Union[str, BinaryIO], total_pages: int) -> List[Tuple[int, str]]:
+        """Extract PDF page text across worker processes, one contiguous page range each."""
+        if isinstance(source, (str, os.PathLike)):
+            data = Path(source).read_bytes()
+        else:
+            source.seek(0)
+            data = source.read()
+        
+        pool = _get_page_pool()
+        range_size = -(-total_pages // PDF_WORKERS)
+        page_texts = []
+        try:
+            # Workers are started on demand by submit(), so that is what needs the stand-in
+            with _page_pool_lock, _spawn_without_main():
+                futures = [
+                    pool.submit(_extract_page_range, data, start, min(start + range_size, total_pages))
+                    for start in range(0, total_pages, range_size)
+                ]
+            
+            # Ranges are submitted in page order, so collecting in order keeps pages sorted
+            for future in futures:
+                page_texts.extend(future.result())
+        except BrokenProcessPool:
+            _reset_page_pool(pool)
+            raise
+        return page_texts
+    
     def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
         """
         Simple text chunking with overlap.
@@ -140,27 +243,28 @@ class DocumentProcessor:
         Returns:
             List of text chunks
         """
-        if len(text) <= chunk_size:
+        text_length = len(text)
+        if text_length <= chunk_size:
             return [text]
         
         chunks = []
         start = 0
         
-        while start < len(text):
+        while start < text_length:
             end = start + chunk_size
             
             # Try to break at sentence boundaries
-            if end < len(text):
-                # Look for sentence endings
-                sentence_endings = ['.', '!', '?', '\n\n']
-                best_break = end
-                
-                for i in range(end - 100, end + 100):
-                    if i < len(text) and text[i] in sentence_endings:
-                        best_break = i + 1
-                        break
+            if end < text_length:
+                # Break after the first sentence ending within 100 characters of the target
+                window_start = end - 100
+                window_end = min(end + 100, text_length)
+                breaks = [
+                    pos for pos in (text.find(ending, window_start, window_end) for ending in SENTENCE_ENDINGS)
+                    if pos != -1
+                ]
                 
-                end = best_break
+                if breaks:
+                    end = min(breaks) + 1
             
             chunk = text[start:end].strip()
             if chunk:
@@ -168,7 +272,7 @@ class DocumentProcessor:
             
             start = end - overlap
             
-            if start >= len(text):
+            if start >= text_length:
                 break
         
         return chunks
@@ -1,17 +1,36 @@
 from langchain_ollama import OllamaLLM
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
+import httpx
+
+# Fixed instructions that open every prompt. Keeping them byte-identical and first lets
+# Ollama reuse the cached KV state for these tokens instead of re-encoding them per question.
+PROMPT_PREFIX = """You are a helpful assistant that answers questions based on the provided documents. 
+Use only the information from the provided documents to answer the question. 
+If the answer cannot be found in the documents, say so clearly.
+
+Context from documents:
+"""
 
 class RAGEngine:
     def __init__(self, model_name: str = "qwen3:8b"):
         """Initialize the RAG engine with Ollama."""
         self.llm = OllamaLLM(
             model=model_name,
-            base_url="http://localhost:11434"
+            base_url="http://localhost:11434",
+            num_ctx=8192,
+            # Keep the model, and with it the prompt-prefix cache, loaded between questions
+            keep_alive="1h",
+            # Passed through to the httpx client that Ollama's client keeps for its
+            # lifetime, so every question reuses a pooled keep-alive connection
+            client_kwargs={
+                "timeout": httpx.Timeout(600, connect=5),
+                "limits": httpx.Limits(max_keepalive_connections=4)
+            }
         )
         self.model_name = model_name
     
-    def generate_answer(self, question: str, relevant_docs: List[Dict[str, Any]]) -> str:
-        """Generate an answer based on the question and relevant documents."""
+    def generate_answer(self, question: str, relevant_docs: List[Dict[str, Any]]) -> Iterator[str]:
+        """Stream an answer based on the question and relevant documents, token by token."""
         
         # Prepare context from relevant documents
         context_parts = []
@@ -26,20 +45,14 @@ class RAGEngine:
         prompt = self._create_prompt(question, context)
         
         try:
-            # Generate response
-            response = self.llm.invoke(prompt)
-            return response
+            # Stream the response as it is generated
+            yield from self.llm.stream(prompt)
         except Exception as e:
-            return f"Error generating response: {str(e)}. Please make sure Ollama is running and the model '{self.model_name}' is available."
+            yield f"Error generating response: {str(e)}. Please make sure Ollama is running and the model '{self.model_name}' is available."
     
     def _create_prompt(self, question: str, context: str) -> str:
         """Create a prompt for the LLM."""
-        prompt = f"""You are a helpful assistant that answers questions based on the provided documents. 
-Use only the information from the provided documents to answer the question. 
-If the answer cannot be found in the documents, say so clearly.
-
-Context from documents:
-{context}
+        prompt = PROMPT_PREFIX + f"""{context}
 
 Question: {question}
 
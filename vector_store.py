@@ -1,51 +1,128 @@
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict, Any
-import uuid
+from chromadb.utils import embedding_functions
+from typing import List, Dict, Any, Optional, Set, Tuple
+import numpy as np
+
+# ChromaDB's HNSW index with cosine distance. At the corpus sizes this app handles
+# (thousands of chunks) it keeps full recall and, unlike IVF/PQ, needs no training step.
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
 
 class VectorStore:
     def __init__(self, collection_name: str = "rag_documents"):
         """Initialize ChromaDB vector store."""
         self.client = chromadb.PersistentClient(path="./chroma_db")
         self.collection_name = collection_name
+        # The ONNX MiniLM model that ChromaDB's default embedding function delegates to,
+        # used directly so cached embeddings can be tagged with the model that made them
+        self.embedding_function = embedding_functions.ONNXMiniLM_L6_V2()
+        self.embedding_model = f"{type(self.embedding_function).__name__}/{self.embedding_function.MODEL_NAME}"
         
-        # Create or get collection
-        try:
-            self.collection = self.client.get_collection(name=collection_name)
-        except:
-            self.collection = self.client.create_collection(
-                name=collection_name,
-                metadata={"hnsw:space": "cosine"}
-            )
+        # Unique filenames in the collection, rebuilt only when the chunk count
+        # no longer matches the count they were computed for
+        self._filenames: Optional[Set[str]] = None
+        self._filenames_count = 0
+        
+        # Create or get collection. Chunks and queries are always embedded through
+        # embed(), so the collection's own embedding function is never invoked.
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name,
+            metadata=COLLECTION_METADATA
+        )
     
-    def add_documents(self, chunks: List[str], metadata: Dict[str, Any]):
+    def add_documents(self, file_hash: str, chunks: List[str], metadata: Dict[str, Any],
+                      embeddings: Optional[np.ndarray] = None):
         """Add document chunks to the vector store."""
-        if not chunks:
-            return
+        self.add_documents_batch([(file_hash, chunks, metadata, embeddings)])
+    
+    def add_documents_batch(
+        self, documents: List[Tuple[str, List[str], Dict[str, Any], Optional[np.ndarray]]]
+    ) -> Dict[str, np.ndarray]:
+        """
+        Add the chunks of several documents to the vector store in one pass.
         
-        # Generate unique IDs for each chunk
-        ids = [str(uuid.uuid4()) for _ in chunks]
+        Args:
+            documents: List of (file_hash, chunks, metadata, embeddings) tuples; embeddings
+                may be None, in which case the chunks are embedded here in a single batch
+            
+        Returns:
+            Embeddings computed here, keyed by file hash. Documents whose chunks are
+            already stored are skipped entirely and do not appear.
+        """
+        # The same file uploaded twice in one batch would repeat its IDs
+        unique_documents = {}
+        for document in documents:
+            unique_documents.setdefault(document[0], document)
         
-        # Create metadata for each chunk
-        metadatas = []
-        for i, chunk in enumerate(chunks):
-            chunk_metadata = metadata.copy()
-            chunk_metadata['chunk_index'] = i
-            chunk_metadata['chunk_id'] = ids[i]
-            metadatas.append(chunk_metadata)
+        # IDs derive from the file content hash. A document whose chunks are all present
+        # needs no embedding and no write, which also keeps the vectors stored at first
+        # indexing from being replaced by the cache's quantized copies.
+        pending = []
+        for file_hash, chunks, metadata, embeddings in unique_documents.values():
+            ids = [f"{file_hash}:{i}" for i in range(len(chunks))]
+            if ids and len(self.collection.get(ids=ids, include=[])['ids']) < len(ids):
+                pending.append((file_hash, ids, chunks, metadata, embeddings))
         
-        # Add to collection
-        self.collection.add(
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
+        if not pending:
+            return {}
+        
+        # Embed every document that has no precomputed embeddings in one call
+        to_embed = [chunk for _, _, chunks, _, embeddings in pending if embeddings is None for chunk in chunks]
+        new_embeddings = self.embed(to_embed) if to_embed else np.empty((0, 0), dtype=np.float32)
+        
+        all_chunks = []
+        all_metadatas = []
+        all_ids = []
+        all_embeddings = []
+        computed_embeddings = {}
+        offset = 0
+        
+        for file_hash, ids, chunks, metadata, embeddings in pending:
+            if embeddings is None:
+                embeddings = new_embeddings[offset:offset + len(chunks)]
+                offset += len(chunks)
+                computed_embeddings[file_hash] = embeddings
+            
+            # Chunks carry only what lookups and removal need; document-level
+            # metadata is stored once in the app's cache, not once per chunk
+            filename = metadata['filename']
+            all_metadatas.extend({'filename': filename, 'chunk_index': i} for i in range(len(chunks)))
+            
+            all_chunks.extend(chunks)
+            all_ids.extend(ids)
+            all_embeddings.append(embeddings)
+        
+        all_embeddings = np.concatenate(all_embeddings)
+        
+        # Upsert into collection, split only where ChromaDB's batch limit requires it
+        batch_size = self.client.get_max_batch_size()
+        for start in range(0, len(all_chunks), batch_size):
+            end = start + batch_size
+            self.collection.upsert(
+                documents=all_chunks[start:end],
+                embeddings=all_embeddings[start:end],
+                metadatas=all_metadatas[start:end],
+                ids=all_ids[start:end]
+            )
+        
+        if self._filenames is not None:
+            self._filenames.update(metadata['filename'] for _, _, _, metadata, _ in pending)
+            self._filenames_count = self.collection.count()
+        
+        return computed_embeddings
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts with the collection's embedding function."""
+        return np.asarray(self.embedding_function(texts), dtype=np.float32)
     
     def similarity_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """Search for similar documents."""
+        # Embed the query with the same function used for the chunks and fetch
+        # only the fields the results below are built from
         results = self.collection.query(
-            query_texts=[query],
-            n_results=k
+            query_embeddings=self.embed([query]),
+            n_results=k,
+            include=["documents", "metadatas", "distances"]
         )
         
         # Format results
@@ -73,15 +150,7 @@ class VectorStore:
         """Get statistics about the vector store."""
         try:
             total_chunks = self.collection.count()
-            
-            # Get all metadata to calculate unique files
-            all_results = self.collection.get()
-            unique_files = set()
-            
-            if all_results['metadatas']:
-                for metadata in all_results['metadatas']:
-                    if 'filename' in metadata:
-                        unique_files.add(metadata['filename'])
+            unique_files = self._unique_filenames(total_chunks)
             
             return {
                 'total_chunks': total_chunks,
@@ -95,33 +164,49 @@ class VectorStore:
                 'total_docs': 0
             }
     
+    def _unique_filenames(self, total_chunks: int) -> Set[str]:
+        """Return the set of filenames in the collection, scanning only when it changed."""
+        if self._filenames is None or self._filenames_count != total_chunks:
+            # Get all metadata to calculate unique files
+            all_results = self.collection.get(include=["metadatas"])
+            unique_files = set()
+            
+            if all_results['metadatas']:
+                for metadata in all_results['metadatas']:
+                    if 'filename' in metadata:
+                        unique_files.add(metadata['filename'])
+            
+            self._filenames = unique_files
+            self._filenames_count = total_chunks
+        
+        return self._filenames
+    
     def clear(self):
         """Clear all documents from the vector store."""
         try:
             self.client.delete_collection(name=self.collection_name)
             self.collection = self.client.create_collection(
                 name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}
+                metadata=COLLECTION_METADATA
             )
+            self._filenames = set()
+            self._filenames_count = 0
         except:
             pass
     
     def remove_documents_by_filename(self, filename: str):
         """Remove all documents with the specified filename from the vector store."""
         try:
-            # Get all documents
-            all_results = self.collection.get()
-            
-            # Find IDs of documents with matching filename
-            ids_to_remove = []
-            if all_results['metadatas']:
-                for i, metadata in enumerate(all_results['metadatas']):
-                    if metadata.get('filename') == filename:
-                        ids_to_remove.append(all_results['ids'][i])
+            # Let ChromaDB filter on the filename instead of scanning every record
+            where = {"filename": filename}
+            ids_to_remove = self.collection.get(where=where, include=[])['ids']
             
             # Remove the documents
             if ids_to_remove:
-                self.collection.delete(ids=ids_to_remove)
+                self.collection.delete(where=where)
+                if self._filenames is not None:
+                    self._filenames.discard(filename)
+                    self._filenames_count = self.collection.count()
                 return len(ids_to_remove)
             return 0
         except Exception as e: